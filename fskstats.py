@@ -6,14 +6,18 @@
 #	Mark Jessop 2016-03-13 <vk5qi@rfhead.net>
 #
 #	NOTE: This is intended to be run on a 'live' stream of samples, and hence expects
-#	updates at about 10Hz. Anything faster will fill up the input queue and be discarded.
+#	updates at about 10Hz. Anything faster than the plot update rate will be discarded.
 #
 #	Call using: 
 #	<producer>| ./fsk_demod 2X 8 923096 115387 - - S 2> >(python ~/Dev/codec2-dev/octave/fskdemodgui.py) | <consumer>
 #
 #
-import sys, time, json, Queue, argparse
-from threading import Thread
+import sys, os, fcntl, argparse
+try:
+	# Use orjson's much faster parser if it is installed.
+	import orjson as json
+except ImportError:
+	import json
 from pyqtgraph.Qt import QtGui, QtCore
 import numpy as np
 import pyqtgraph as pg
@@ -24,11 +28,16 @@ args = parser.parse_args()
 
 # Some settings...
 update_rate = 2 # Hz
+idle_update_rate = 0.2 # Hz, used once no data has arrived for idle_ticks_max updates.
+idle_ticks_max = 5
 history_size = 100 # 10 seconds at 10Hz...
 history_scale = np.linspace((-1*history_size+1)/float(update_rate),0,history_size)
 
-# Input queue
-in_queue = Queue.Queue(1) # 1-element FIFO... 
+# Latest unprocessed line of input. Newer lines overwrite any frame the GUI hasn't got to yet.
+latest = [None]
+
+# Number of consecutive plot updates which have had no new data.
+idle_ticks = 0
 
 win = pg.GraphicsWindow()
 win.setWindowTitle('FSK Demodulator Modem Statistics')
@@ -56,46 +65,91 @@ ppm_plot.setLabel('left','Clock Offset (ppm)')
 ppm_plot.setLabel('bottom','Time (seconds)')
 fest_plot.setLabel('left','Frequency (Hz)')
 fest_plot.setLabel('bottom','Time (seconds)')
+# The time axis of the history plots never changes, so fix it rather than auto-ranging it every update.
+# (The Eb/No Y axis is already fixed above. Clock offset and tone frequencies still auto-range in Y.)
+for _plot in (ebno_plot, ppm_plot, fest_plot):
+	_plot.disableAutoRange(axis=pg.ViewBox.XAxis)
+	_plot.setXRange(history_scale[0], history_scale[-1], padding=0)
 eye_plot.disableAutoRange()
 eye_plot.setYRange(0,1)
 eye_plot.setXRange(0,15)
 eye_xr = 15
 
-# Data arrays...
-ebno_data = np.zeros(history_size)*np.nan
-ppm_data = np.zeros(history_size)*np.nan
-fest_data = np.zeros((4,history_size))*np.nan
+# History data. All the time-series are held as rows of a single ring buffer, so each update
+# writes one column, with write_idx pointing at the oldest sample.
+EBNO, PPM, F1, F2, F3, F4 = range(6)
+hist = np.zeros((6,history_size))*np.nan
+write_idx = 0
+# Number of samples written into the history so far (up to history_size).
+hist_filled = 0
+
+# Time-ordered copy of the ring buffer, which is handed to pyqtgraph.
+hist_plot = np.zeros((6,history_size))*np.nan
+
+def unroll(ring, out):
+	""" Copy a ring buffer into out, oldest sample first. """
+	_split = history_size - write_idx
+	out[...,:_split] = ring[...,write_idx:]
+	out[...,_split:] = ring[...,:write_idx]
+	return out
+
+# Last spectrum and eye diagram received, so we can skip redrawing them if they haven't changed.
+last_spec = None
+last_eye = None
+
+# Working buffer for the log-scaled spectrum, (re)allocated when the FFT size changes.
+spec_buf = None
+
+# Spectrum peak the Y axis was last scaled to. The axis is only rescaled when this moves by more than spec_yrange_hysteresis dB.
+spec_ymax = None
+spec_yrange_hysteresis = 1.0
 
 # Curve objects, so we can update them...
 spec_curve = spec_plot.plot([0])
-ebno_curve = ebno_plot.plot(x=history_scale,y=ebno_data)
-ppm_curve = ppm_plot.plot(x=history_scale,y=ppm_data)
-fest1_curve = fest_plot.plot(x=history_scale,y=fest_data[0,:],pen='r') # f1 = Red
-fest2_curve = fest_plot.plot(x=history_scale,y=fest_data[1,:],pen='g') # f2 = Blue
-fest3_curve = fest_plot.plot(x=history_scale,y=fest_data[2,:],pen='b') # f3 = Greem
-fest4_curve = fest_plot.plot(x=history_scale,y=fest_data[3,:],pen='m') # f4 = Magenta
-
-# Plot update function. Reads from queue, processes and updates plots.
+# The history curves use connect='finite', so pyqtgraph breaks lines at NaNs (e.g. missing tones)
+# while building the path, rather than drawing through them.
+ebno_curve = ebno_plot.plot(x=history_scale,y=hist[EBNO],connect='finite')
+ppm_curve = ppm_plot.plot(x=history_scale,y=hist[PPM],connect='finite')
+fest1_curve = fest_plot.plot(x=history_scale,y=hist[F1],pen='r',connect='finite') # f1 = Red
+fest2_curve = fest_plot.plot(x=history_scale,y=hist[F2],pen='g',connect='finite') # f2 = Blue
+fest3_curve = fest_plot.plot(x=history_scale,y=hist[F3],pen='b',connect='finite') # f3 = Greem
+fest4_curve = fest_plot.plot(x=history_scale,y=hist[F4],pen='m',connect='finite') # f4 = Magenta
+# The eye diagram traces are all drawn as a single path, with a break between each trace.
+eye_item = QtGui.QGraphicsPathItem()
+eye_item.setPen(pg.mkPen('y'))
+eye_plot.addItem(eye_item)
+# Eye diagram x values and trace breaks, only rebuilt when the eye diagram dimensions change.
+eye_shape = None
+eye_x = None
+eye_connect = None
+# The spectrum and eye diagram are only redrawn when their data changes, so let Qt cache them as
+# pixmaps, instead of repainting the paths whenever something else in the window updates.
+# (spec_curve is a PlotDataItem, which draws nothing itself - its child PlotCurveItem does the painting.)
+spec_curve.curve.setCacheMode(QtGui.QGraphicsItem.DeviceCoordinateCache)
+eye_item.setCacheMode(QtGui.QGraphicsItem.DeviceCoordinateCache)
+
+# Plot update function. Reads the latest input line, processes and updates plots.
 def update_plots():
-	global timeout,timeout_counter,eye_plot,ebno_curve, ppm_curve, fest1_curve, fest2_curve, ebno_data, ppm_data, fest_data, in_queue, eye_xr, spec_curve
+	global timeout,timeout_counter,idle_ticks,eye_plot,ebno_curve, ppm_curve, fest1_curve, fest2_curve, hist, hist_plot, hist_filled, write_idx, latest, eye_xr, eye_item, eye_shape, eye_x, eye_connect, spec_curve, last_spec, last_eye, spec_buf, spec_ymax
+
+	in_data = latest[0]
+	if in_data is None:
+		# Nothing new to plot. If this keeps happening, slow down the update timer.
+		idle_ticks += 1
+		if idle_ticks == idle_ticks_max:
+			timer.setInterval(int(1000/idle_update_rate))
+		return
+	latest[0] = None
+	idle_ticks = 0
 
 	try:
-		if in_queue.empty():
-			return
-		in_data = in_queue.get_nowait()
 		in_data = json.loads(in_data)
 	except Exception as e:
 
 		sys.stderr.write(str(e))
 		return
 
-	# Roll data arrays
-	ebno_data[:-1] = ebno_data[1:]
-	ppm_data[:-1] = ppm_data[1:]
-	fest_data = np.roll(fest_data,-1,axis=1)
-
-
-	# Try reading in the new data points from the dictionary.
+	# Try reading in the new data points from the dictionary. If any are missing, drop the frame.
 	try:
 		new_ebno = in_data['EbNodB']
 		new_ppm = in_data['ppm']
@@ -104,47 +158,61 @@ def update_plots():
 		new_spec = in_data['samp_fft']
 	except Exception as e:
 		print("ERROR reading dict: %s" % e)
+		return
 
-	# Try reading in the other 2 tones.
-	try:
-		new_fest3 = in_data['f3_est']
-		new_fest4 = in_data['f4_est']
-		fest_data[2,-1] = new_fest3
-		fest_data[3,-1] = new_fest4
-	except:
-		# If we can't read these tones out of the dict, fill with NaN
-		fest_data[2,-1] = np.nan
-		fest_data[3,-1] = np.nan
-
-	# Add in new data points
-	ebno_data[-1] = new_ebno
-	ppm_data[-1] = new_ppm
-	fest_data[0,-1] = new_fest1
-	fest_data[1,-1] = new_fest2
-
-	# Update plots
-	spec_data_log = 20*np.log10(np.array(new_spec)+0.01)
-	spec_curve.setData(spec_data_log)
-	spec_plot.setYRange(spec_data_log.max()-50,spec_data_log.max()+10)
-	ebno_curve.setData(x=history_scale,y=ebno_data)
-	ppm_curve.setData(x=history_scale,y=ppm_data)
-	fest1_curve.setData(x=history_scale,y=fest_data[0,:],pen='r') # f1 = Red
-	fest2_curve.setData(x=history_scale,y=fest_data[1,:],pen='g') # f2 = Blue
-	fest3_curve.setData(x=history_scale,y=fest_data[2,:],pen='b') # f3 = Green
-	fest4_curve.setData(x=history_scale,y=fest_data[3,:],pen='m') # f4 = Magenta
+	# Add in new data points, overwriting the oldest sample in the ring buffer.
+	# The other 2 tones are only present for 4FSK, so fill them with NaN if they're missing.
+	hist[:,write_idx] = (new_ebno, new_ppm, new_fest1, new_fest2, in_data.get('f3_est', np.nan), in_data.get('f4_est', np.nan))
+	write_idx = (write_idx + 1) % history_size
+	hist_filled = min(hist_filled + 1, history_size)
+
+	# Update plots. The spectrum is only redrawn if it has changed.
+	if new_spec != last_spec:
+		last_spec = new_spec
+		if spec_buf is None or spec_buf.size != len(new_spec):
+			spec_buf = np.empty(len(new_spec), dtype=np.float32)
+		# spec_buf = 20*log10(new_spec + 0.01), without allocating temporaries.
+		# Filling the buffer directly avoids building an intermediate float64 array from the list.
+		spec_buf[:] = new_spec
+		np.add(spec_buf, 0.01, out=spec_buf)
+		np.log10(spec_buf, out=spec_buf)
+		np.multiply(spec_buf, 20.0, out=spec_buf)
+		spec_curve.setData(spec_buf)
+		_spec_max = spec_buf.max()
+		if spec_ymax is None or abs(_spec_max - spec_ymax) > spec_yrange_hysteresis:
+			spec_ymax = _spec_max
+			spec_plot.setYRange(spec_ymax-50,spec_ymax+10)
+	unroll(hist, hist_plot)
+	# Until the history has filled up, only hand over the samples we actually have, rather than
+	# a mostly-NaN array. Once full, these slices are just views of the whole arrays.
+	_hist_x = history_scale[-hist_filled:]
+	_hist_y = hist_plot[:,-hist_filled:]
+	# Pens are set when the curves are created. Passing them again here would rebuild them every update.
+	ebno_curve.setData(x=_hist_x,y=_hist_y[EBNO])
+	ppm_curve.setData(x=_hist_x,y=_hist_y[PPM])
+	fest1_curve.setData(x=_hist_x,y=_hist_y[F1])
+	fest2_curve.setData(x=_hist_x,y=_hist_y[F2])
+	fest3_curve.setData(x=_hist_x,y=_hist_y[F3])
+	fest4_curve.setData(x=_hist_x,y=_hist_y[F4])
 
 	#Now try reading in and plotting the eye diagram
 	try:
-		eye_data = np.array(in_data['eye_diagram'])
-
-		#eye_plot.disableAutoRange()
-		eye_plot.clear()
-		col_index = 0
-		for line in eye_data:
-			eye_plot.plot(line,pen=(col_index,eye_data.shape[0]))
-			col_index += 1
-		#eye_plot.autoRange()
-		
+		new_eye = in_data['eye_diagram']
+		if new_eye == last_eye:
+			return
+		last_eye = new_eye
+		eye_data = np.array(new_eye, dtype=float)
+
+		# Lay the traces end-to-end, and only connect points within each trace.
+		# (connect[i] controls the segment from point i to point i+1, so break after the last point of each trace.)
+		if eye_data.shape != eye_shape:
+			eye_shape = eye_data.shape
+			_traces, _trace_len = eye_shape
+			eye_x = np.tile(np.arange(_trace_len), _traces)
+			eye_connect = np.ones(eye_data.size, dtype=np.int32)
+			eye_connect[_trace_len-1::_trace_len] = 0
+		eye_item.setPath(pg.arrayToQPath(eye_x, eye_data.ravel(), connect=eye_connect))
+
 		#Quick autoranging for x-axis to allow for differing P and Ts values
 		if eye_xr != len(eye_data[0]) - 1:
 			eye_xr = len(eye_data[0]) - 1
@@ -156,28 +224,59 @@ def update_plots():
 
 timer = pg.QtCore.QTimer()
 timer.timeout.connect(update_plots)
-timer.start(1000/update_rate)
+timer.start(int(1000/update_rate))
 
 
-# Thread to read from stdin and push into a queue to be processed.
+# Put stdin into non-blocking mode, so it can be read from within the Qt event loop.
+stdin_fd = sys.stdin.fileno()
+fcntl.fcntl(stdin_fd, fcntl.F_SETFL, fcntl.fcntl(stdin_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+# Any partial line left over from the last read of stdin.
+stdin_partial = b''
+# Longest partial line we will hold on to. Anything longer isn't a valid frame.
+stdin_partial_max = 65536
+
+# Read everything available on stdin, and store the latest complete line to be processed.
 def read_input():
-	global in_queue
+	global latest, stdin_notifier, idle_ticks, stdin_partial
+
+	try:
+		in_data = os.read(stdin_fd, 65536)
+	except OSError:
+		# Nothing to read after all.
+		return
+
+	# An empty read means fsk_demod has closed stdin, so stop watching it.
+	# This stops the notifier firing continuously on EOF.
+	if in_data == b'':
+		stdin_notifier.setEnabled(False)
+		return
+
+	# Hold back anything after the last newline until the rest of it arrives,
+	# so that we never try and parse a partial frame.
+	in_data = stdin_partial + in_data
+	_end = in_data.rfind(b'\n')
+	stdin_partial = in_data[_end+1:]
+	# If we never see a newline (garbage on stdin), don't let the partial line grow without limit.
+	if len(stdin_partial) > stdin_partial_max:
+		stdin_partial = b''
+	if _end == -1:
+		return
 
-	while True:
-		in_line = sys.stdin.readline()
+	# Only the last complete line will be plotted, so find it directly rather than
+	# splitting out all the older lines just to discard them.
+	_start = in_data.rfind(b'\n', 0, _end) + 1
 
-		# Only push actual data into the queue...
-		# This stops sending heaps of empty strings into the queue when fsk_demod closes.
-		if in_line == "":
-			time.sleep(0.1)
-			continue
+	# Overwrite any frame which hasn't been plotted yet.
+	latest[0] = in_data[_start:_end]
 
-		if not in_queue.full():
-			in_queue.put_nowait(in_line)
+	# If the update timer has slowed down, bring it back to the normal rate.
+	if idle_ticks >= idle_ticks_max:
+		idle_ticks = 0
+		timer.setInterval(int(1000/update_rate))
 
-read_thread = Thread(target=read_input)
-read_thread.daemon = True # Set as daemon, so when all other threads die, this one gets killed too.
-read_thread.start()
+stdin_notifier = QtCore.QSocketNotifier(stdin_fd, QtCore.QSocketNotifier.Read)
+stdin_notifier.activated.connect(read_input)
 
 ## Start Qt event loop unless running in interactive mode or using pyside.
 if __name__ == '__main__':
@@ -14,16 +14,16 @@
 #
 #   Dependencies:
 #       The following Python packages are required (install with: sudo pip install <package>)
-#       * crcmod
 #       * requests
 #
 #   Example Usage (SSB demod via GQRX, decoding using 'horus_api' from codec2-dev):
 #   $ nc -l -u localhost 7355 | ./horus_demod <arguments> | python horusbinary.py
 #
 import argparse
-import codecs
-import crcmod
+import binascii
+import csv
 import datetime
+import errno
 import json
 import logging
 import os
@@ -35,17 +35,11 @@ import struct
 import sys
 import time
 import traceback
-from threading import Thread
+from threading import Thread, Condition, Event
 from base64 import b64encode
+from collections import deque, OrderedDict
 from hashlib import sha256
 
-try:
-    # Python 2
-    from Queue import Queue
-except ImportError:
-    # Python 3
-    from queue import Queue
-
 try:
     # Python 2
     from ConfigParser import RawConfigParser
@@ -65,27 +59,58 @@ summary_port = -1
 
 # Log file object
 log_file = None
+
+#
+# HTTP Sessions
+#
+
+def create_http_session():
+    ''' Create a requests Session, which keeps connections alive between requests. '''
+    _session = requests.Session()
+    # Retries are handled by the callers, so don't let urllib3 retry on its own.
+    _adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0)
+    _session.mount('http://', _adapter)
+    _session.mount('https://', _adapter)
+    return _session
+
+# Shared HTTP session, used for listener information, UUID and payload ID list requests.
+http_session = create_http_session()
+
 #
 # Habitat Uploader Class
 #
 
+# Telemetry sentences are PUT to this URL, followed by the sha256 hash of the base64-encoded sentence.
+_HABITAT_PUT_PREFIX = "http://habitat.habhub.org/habitat/_design/payload_telemetry/_update/add_listener/"
+
 class HabitatUploader(object):
     ''' 
     Queued Habitat Telemetry Uploader class 
     
-    Packets to be uploaded to Habitat are added to a queue for uploading.
+    Packets to be uploaded to Habitat are added to a queue for uploading,
+    which is serviced by a small pool of uploader threads.
     If an upload attempt times out, the packet is discarded.
     If the queue fills up (probably indicating no network connection, and a fast packet downlink rate),
-    it is immediately emptied, to avoid upload of out-of-date packets.
+    the oldest packets are discarded, to avoid upload of out-of-date packets.
     '''
 
+    __slots__ = ('user_callsign', 'upload_timeout', 'upload_retries', 'upload_retry_interval',
+        'upload_retry_max_interval', 'queue_size', 'habitat_upload_queue', 'habitat_upload_condition',
+        'inhibit', 'upload_workers', 'upload_body_template', 'dropped', 'dropped_report_interval',
+        'dropped_last_report', 'dropped_report_time', 'recent_sentences', 'recent_sentences_size',
+        'uploading_sentences', 'habitat_uploader_running', 'uploadthreads')
+
 
     def __init__(self, user_callsign='FSK_DEMOD', 
                 queue_size=16,
                 upload_timeout = 10,
                 upload_retries = 5,
                 upload_retry_interval = 0.25,
+                upload_retry_max_interval = 30.0,
                 inhibit = False,
+                upload_workers = 4,
+                dropped_report_interval = 60.0,
+                recent_sentences_size = 64,
                 ):
         ''' Create a Habitat Uploader object. ''' 
 
@@ -93,53 +118,71 @@ class HabitatUploader(object):
         self.upload_timeout = upload_timeout
         self.upload_retries = upload_retries
         self.upload_retry_interval = upload_retry_interval
+        self.upload_retry_max_interval = upload_retry_max_interval
         self.queue_size = queue_size
-        self.habitat_upload_queue = Queue(queue_size)
+        # Newest sentences push the oldest out of the queue once it is full.
+        self.habitat_upload_queue = deque(maxlen=queue_size)
+        self.habitat_upload_condition = Condition()
         self.inhibit = inhibit
-
-        # Start the uploader thread.
+        self.upload_workers = upload_workers
+
+        # Only the sentence and upload time change between uploads, so pre-build the rest of the JSON document.
+        # (Any %'s in the callsign need escaping, so they survive the string formatting.)
+        self.upload_body_template = ('{"type":"payload_telemetry","data":{"_raw":"%s"},"receivers":{'
+            + json.dumps(user_callsign).replace('%', '%%') + ':{"time_created":"%s","time_uploaded":"%s"}}}')
+
+        # Count of sentences discarded from the upload queue.
+        self.dropped = 0
+        self.dropped_report_interval = dropped_report_interval
+        self.dropped_last_report = 0
+        self.dropped_report_time = time.time()
+
+        # The most recently uploaded sentences, used to skip uploading the same sentence twice.
+        self.recent_sentences = OrderedDict()
+        self.recent_sentences_size = recent_sentences_size
+        # Sentences which an uploader thread has taken off the queue, but not finished uploading.
+        self.uploading_sentences = set()
+
+        # Start the uploader threads. Running several means a slow upload (or retry delay)
+        # doesn't hold up the sentences queued behind it.
         self.habitat_uploader_running = True
-        self.uploadthread = Thread(target=self.habitat_upload_thread)
-        self.uploadthread.start()
+        self.uploadthreads = []
+        for _i in range(self.upload_workers):
+            _thread = Thread(target=self.habitat_upload_thread)
+            _thread.start()
+            self.uploadthreads.append(_thread)
 
-    def habitat_upload(self, sentence):
-        ''' Upload a UKHAS-standard telemetry sentence to Habitat '''
+    def habitat_upload(self, sentence, session):
+        ''' Upload a UKHAS-standard telemetry sentence (as bytes) to Habitat, using the supplied requests Session '''
 
         # Generate payload to be uploaded
         # b64encode accepts and returns bytes objects.
-        _sentence_b64 = b64encode(sentence.encode('ascii'))
-        _date = datetime.datetime.utcnow().isoformat("T") + "Z"
-        _user_call = self.user_callsign
-
-        _data = {
-            "type": "payload_telemetry",
-            "data": {
-                "_raw": _sentence_b64.decode('ascii') # Convert back to a string to be serialisable
-                },
-            "receivers": {
-                _user_call: {
-                    "time_created": _date,
-                    "time_uploaded": _date,
-                    },
-                },
-        }
+        _sentence_b64 = b64encode(sentence)
+        _date = _iso_now_cached()
 
-        # The URl to upload to.
-        _url = "http://habitat.habhub.org/habitat/_design/payload_telemetry/_update/add_listener/%s" % sha256(_sentence_b64).hexdigest()
+        # b64encode only produces characters which don't need escaping in a JSON string.
+        _body = (self.upload_body_template % (_sentence_b64.decode('ascii'), _date, _date)).encode('ascii')
 
-        # Delay for a random amount of time between 0 and upload_retry_interval*2 seconds.
-        time.sleep(random.random()*self.upload_retry_interval*2.0)
+        # The URl to upload to.
+        _url = _HABITAT_PUT_PREFIX + sha256(_sentence_b64).hexdigest()
 
         _retries = 0
+        _upload_success = False
 
-        # When uploading, we have three possible outcomes:
-        # - Can't connect. No point re-trying in this situation.
+        # When uploading, we have four possible outcomes:
+        # - Can't connect, or the connection times out. This may be transient, so we can retry.
+        # - Some other request error. No point re-trying in this situation.
         # - The packet is uploaded successfult (201 / 403)
         # - There is a upload conflict on the Habitat DB end (409). We can retry and it might work.
         while _retries < self.upload_retries:
             # Run the request.
             try:
-                _req = requests.put(_url, data=json.dumps(_data), timeout=self.upload_timeout)
+                _req = session.put(_url, data=_body, timeout=self.upload_timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                logging.error("Habitat - Upload Failed, retrying: %s" % str(e))
+                time.sleep(self.retry_delay(_retries))
+                _retries += 1
+                continue
             except Exception as e:
                 logging.error("Habitat - Upload Failed: %s" % str(e))
                 break
@@ -152,46 +195,84 @@ class HabitatUploader(object):
             elif _req.status_code == 409:
                 # 409 = Upload conflict (server busy). Sleep for a moment, then retry.
                 logging.info("Habitat - Upload conflict.. retrying.")
-                time.sleep(random.random()*self.upload_retry_interval)
+                time.sleep(self.retry_delay(_retries))
                 _retries += 1
             else:
                 logging.error("Habitat - Error uploading to Habitat. Status Code: %d." % _req.status_code)
                 break
 
         if _retries == self.upload_retries:
-            logging.error("Habitat - Upload conflict not resolved with %d retries." % self.upload_retries)
+            logging.error("Habitat - Upload not successful after %d retries." % self.upload_retries)
+
+        # The sentence is no longer in flight. Only remember it if it made it to Habitat,
+        # so a failed upload can be retried if the sentence is received again.
+        with self.habitat_upload_condition:
+            self.uploading_sentences.discard(sentence)
+            if _upload_success:
+                self.recent_sentences[sentence] = True
+                if len(self.recent_sentences) > self.recent_sentences_size:
+                    self.recent_sentences.popitem(last=False)
 
         return
 
 
+    def retry_delay(self, retries):
+        ''' 
+        Calculate how long to wait before the next upload attempt, using exponential backoff with full jitter:
+        A random delay between 0 and upload_retry_interval*2^retries, capped at upload_retry_max_interval.
+        '''
+        return random.random()*min(self.upload_retry_max_interval, self.upload_retry_interval*(2**retries))
+
+
     def habitat_upload_thread(self):
         ''' Handle uploading of packets to Habitat '''
 
         logging.info("Started Habitat Uploader Thread.")
 
-        while self.habitat_uploader_running:
+        # Each uploader thread has its own HTTP session (requests Sessions aren't thread-safe),
+        # so its uploads can re-use the same connection to the Habitat server.
+        _session = create_http_session()
+        _session.headers.update({'Content-Type': 'application/json'})
 
-            if self.habitat_upload_queue.qsize() > 0:
-                # If the queue is completely full, jump to the most recent telemetry sentence.
-                if self.habitat_upload_queue.qsize() == self.queue_size:
-                    while not self.habitat_upload_queue.empty():
-                        sentence = self.habitat_upload_queue.get()
+        while True:
+            with self.habitat_upload_condition:
+                # Block until a sentence arrives, or close() wakes us up.
+                while self.habitat_uploader_running and len(self.habitat_upload_queue) == 0:
+                    self.habitat_upload_condition.wait(self.dropped_report_interval)
+                    self.report_dropped()
 
-                    logging.warning("Habitat uploader queue was full - possible connectivity issue.")
-                else:
-                    # Otherwise, get the first item in the queue.
-                    sentence = self.habitat_upload_queue.get()
+                if not self.habitat_uploader_running:
+                    break
 
-                # Attempt to upload it.
-                self.habitat_upload(sentence)
+                # Take one sentence, leaving any others in the queue for the other uploader threads.
+                _sentence = self.habitat_upload_queue.popleft()
+                self.uploading_sentences.add(_sentence)
 
-            else:
-                # Wait for a short time before checking the queue again.
-                time.sleep(0.1)
+                self.report_dropped()
+
+            # Delay for a random amount of time between 0 and upload_retry_interval*2 seconds.
+            time.sleep(random.random()*self.upload_retry_interval*2.0)
+
+            # Attempt to upload it.
+            self.habitat_upload(_sentence, _session)
 
         logging.info("Stopped Habitat Uploader Thread.")
 
 
+    def report_dropped(self):
+        ''' Log the number of sentences dropped since the last report. Must be called with habitat_upload_condition held. '''
+        _now = time.time()
+        if (_now - self.dropped_report_time) < self.dropped_report_interval:
+            return
+
+        _delta = self.dropped - self.dropped_last_report
+        if _delta > 0:
+            logging.warning("Habitat Uploader - dropped=%d in last %ds (total %d) - possible connectivity issue." % (_delta, int(_now - self.dropped_report_time), self.dropped))
+
+        self.dropped_last_report = self.dropped
+        self.dropped_report_time = _now
+
+
     def add(self, sentence):
         ''' Add a sentence to the upload queue '''
 
@@ -205,18 +286,36 @@ class HabitatUploader(object):
         # Now add the *correct* number of $$s back on.
         sentence = '$$' +sentence
 
-        if not (sentence[-1] == '\n'):
+        if not sentence.endswith('\n'):
             sentence += '\n'
 
+        # The uploader threads work with the sentence as bytes.
         try:
-            self.habitat_upload_queue.put_nowait(sentence)
-        except Exception as e:
-            logging.error("Error adding sentence to queue: %s" % str(e))
+            sentence = sentence.encode('ascii')
+        except UnicodeError:
+            logging.error("Habitat - Sentence contains non-ASCII characters, not uploading.")
+            return
+
+        with self.habitat_upload_condition:
+            # Skip sentences which have already been uploaded, are being uploaded, or are waiting to be.
+            if (sentence in self.recent_sentences) or (sentence in self.uploading_sentences) or (sentence in self.habitat_upload_queue):
+                logging.debug("Habitat - Sentence already uploaded or queued for upload, skipping.")
+                return
+
+            # If the queue is full, this discards the oldest sentence.
+            if len(self.habitat_upload_queue) == self.queue_size:
+                self.dropped += 1
+
+            self.habitat_upload_queue.append(sentence)
+            self.habitat_upload_condition.notify()
 
 
     def close(self):
-        ''' Shutdown uploader thread. '''
-        self.habitat_uploader_running = False
+        ''' Shutdown uploader threads. '''
+        # Wake up the uploader threads, if they are waiting on the queue.
+        with self.habitat_upload_condition:
+            self.habitat_uploader_running = False
+            self.habitat_upload_condition.notify_all()
 
 #
 # Habitat Listener Position
@@ -229,42 +328,77 @@ url_habitat_db = HABITAT_URL + "habitat/"
 
 uuids = []
 
+# UUIDs are fetched by a background thread, which tops up the uuids list when it runs low.
+# uuids_condition protects the uuids list, and is notified when new UUIDs arrive.
+uuids_condition = Condition()
+uuids_refill = Event()
+uuids_low_water = 3
+uuid_fetch_thread = None
+
 def ISOStringNow():
     return "%sZ" % datetime.datetime.utcnow().isoformat()
 
 
+# Most recent (integer UNIX time, ISO-8601 string) pair produced by _iso_now_cached.
+_last_iso = (0, None)
+
+def _iso_now_cached():
+    ''' Return the current UTC time as an ISO-8601 string, to the second. The string is only re-generated once per second. '''
+    global _last_iso
+
+    _now = int(time.time())
+    _cached = _last_iso
+    if _now != _cached[0]:
+        _cached = (_now, datetime.datetime.utcfromtimestamp(_now).isoformat("T") + "Z")
+        _last_iso = _cached
+
+    return _cached[1]
+
+
 def postListenerData(doc, timeout=10):
     global uuids, url_habitat_db
-    # do we have at least one uuid, if not go get more
-    if len(uuids) < 1:
-        fetchUuids()
 
-    # Attempt to add UUID and time data to document.
-    try:
-        doc['_id'] = uuids.pop()
-    except IndexError:
-        logging.error("Habitat - Unable to post listener data - no UUIDs available.")
-        return False
+    startUuidFetcher()
+
+    with uuids_condition:
+        # If we are running low on uuids, ask the fetcher thread for more.
+        if len(uuids) < uuids_low_water:
+            uuids_refill.set()
+
+        # If we have none at all, wait (for a limited time) for the fetcher to get some.
+        if len(uuids) < 1:
+            uuids_condition.wait(timeout)
+
+        # Attempt to add UUID and time data to document.
+        try:
+            doc['_id'] = uuids.pop()
+        except IndexError:
+            logging.error("Habitat - Unable to post listener data - no UUIDs available.")
+            return False
 
     doc['time_uploaded'] = ISOStringNow()
 
     try:
-        _r = requests.post(url_habitat_db, json=doc, timeout=timeout)
+        _r = http_session.post(url_habitat_db, json=doc, timeout=timeout)
         return True
     except Exception as e:
         logging.error("Habitat - Could not post listener data - %s" % str(e))
         return False
 
 
-def fetchUuids(timeout=10):
+def fetchUuids(session, timeout=10):
+    ''' Fetch UUIDs from Habitat using the supplied requests Session, and add them to the uuids list. '''
     global uuids, url_habitat_uuids
 
     _retries = 5
 
     while _retries > 0:
         try:
-            _r = requests.get(url_habitat_uuids % 10, timeout=timeout)
-            uuids.extend(_r.json()['uuids'])
+            _r = session.get(url_habitat_uuids % 10, timeout=timeout)
+            _new_uuids = _r.json()['uuids']
+            with uuids_condition:
+                uuids.extend(_new_uuids)
+                uuids_condition.notify_all()
             logging.debug("Habitat - Got UUIDs")
             return
         except Exception as e:
@@ -277,6 +411,28 @@ def fetchUuids(timeout=10):
     return
 
 
+def uuidFetchThread():
+    ''' Fetch more UUIDs from Habitat whenever postListenerData asks for them. '''
+
+    # This thread has its own HTTP session, as the main thread uses http_session (requests Sessions aren't thread-safe).
+    _session = create_http_session()
+
+    while True:
+        uuids_refill.wait()
+        uuids_refill.clear()
+        fetchUuids(_session)
+
+
+def startUuidFetcher():
+    ''' Start the background UUID fetcher thread, if it isn't already running. '''
+    global uuid_fetch_thread
+
+    if uuid_fetch_thread is None:
+        uuid_fetch_thread = Thread(target=uuidFetchThread)
+        uuid_fetch_thread.daemon = True
+        uuid_fetch_thread.start()
+
+
 def initListenerCallsign(callsign, radio='', antenna=''):
     doc = {
             'type': 'listener_information',
@@ -334,48 +490,137 @@ def uploadListenerPosition(callsign, lat, lon, radio='', antenna=''):
 # Utility functions
 #
 
-def crc16_ccitt(data):
+if sys.version_info[0] >= 3:
+    def ascii_from_buffer(buf):
+        ''' Convert a buffer (e.g. a memoryview) of ASCII data into a string, without an intermediate bytes copy. '''
+        return str(buf, 'ascii')
+else:
+    def ascii_from_buffer(buf):
+        ''' Convert a buffer (e.g. a memoryview) of ASCII data into a string. In Python 2, str is bytes. '''
+        return buf.tobytes()
+
+def _crc16_raw(data):
     """
-    Calculate the CRC16 CCITT checksum of *data*.
+    Calculate the CRC16 CCITT checksum of *data*, as an integer.
     
     (CRC16 CCITT: start 0xFFFF, poly 0x1021)
+    binascii.crc_hqx implements this CRC (with a 0xFFFF start value) in C.
+    """
+    return binascii.crc_hqx(data, 0xFFFF)
+
+def crc16_ccitt(data):
     """
-    crc16 = crcmod.predefined.mkCrcFun('crc-ccitt-false')
-    return hex(crc16(data))[2:].upper().zfill(4)
+    Calculate the CRC16 CCITT checksum of *data*, as a 4-character hex string.
+    """
+    return "%04X" % _crc16_raw(data)
 
 
 
 #
-# OziMux UDP Packet Generation Functions
+# UDP Broadcast Output
 #
 
-def oziplotter_upload_basic_telemetry(time, latitude, longitude, altitude):
-    """
-    Send a sentence of position data to Oziplotter/OziMux, via UDP.
-    """
-    global ozi_port
-    sentence = "TELEMETRY,%s,%.5f,%.5f,%d\n" % (time, latitude, longitude, altitude)
+class UDPBroadcaster(object):
+    '''
+    Persistent UDP broadcast output socket.
 
-    try:
-        _ozisock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+    The socket is connected to its destination, so each packet only needs a send() call.
+    Sending to a broadcast address can fail when there is no network connected.
+    In this case, packets are sent to localhost instead, and we stay with localhost
+    for broadcast_retry_interval seconds before trying the broadcast address again.
+    '''
+
+    # Numeric form of '<broadcast>' (INADDR_BROADCAST).
+    BROADCAST_ADDRESS = '255.255.255.255'
+    LOCALHOST_ADDRESS = '127.0.0.1'
+
+    def __init__(self, port, broadcast_retry_interval = 60.0):
+        ''' Create a UDP broadcast socket, for sending to the supplied port. '''
 
+        self.port = port
+        self.broadcast_retry_interval = broadcast_retry_interval
+
+        self.sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
         # Set up socket for broadcast, and allow re-use of the address
-        _ozisock.setsockopt(socket.SOL_SOCKET,socket.SO_BROADCAST,1)
-        _ozisock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET,socket.SO_BROADCAST,1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         # SO_REUSEPORT doesn't work on all platforms, so catch the exception if it fails
         try:
-            _ozisock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         except:
             pass
-        # Send!
+
+        self.address = self.BROADCAST_ADDRESS
+        self.connected = False
+        self.fallback_time = 0
+
+
+    def connect(self, address):
+        ''' Connect the socket to the supplied address, on our port. '''
+        self.address = address
+        self.connected = False
+        self.sock.connect((self.address, self.port))
+        self.connected = True
+
+
+    def send_connected(self, data):
+        ''' Send a packet on the connected socket. '''
+        try:
+            self.sock.send(data)
+        except socket.error as e:
+            # A connected UDP socket reports ICMP 'port unreachable' errors from earlier packets
+            # (i.e. nothing listening on localhost) on the next send. Ignore these, and send again.
+            if e.errno != errno.ECONNREFUSED:
+                raise
+            self.sock.send(data)
+
+
+    def send(self, data):
+        ''' Send a packet (bytes) to the broadcast address, or to localhost if broadcast has failed recently. '''
+
+        if (self.address != self.BROADCAST_ADDRESS) and ((time.time() - self.fallback_time) > self.broadcast_retry_interval):
+            self.address = self.BROADCAST_ADDRESS
+            self.connected = False
+
         try:
-            _ozisock.sendto(sentence.encode('ascii'),('<broadcast>',ozi_port))
+            if not self.connected:
+                self.connect(self.address)
+            self.send_connected(data)
         except socket.error as e:
-            logging.warning("Send to broadcast address failed, sending to localhost instead.")
-            _ozisock.sendto(sentence.encode('ascii'),('127.0.0.1',ozi_port))
+            if self.address == self.LOCALHOST_ADDRESS:
+                raise
 
-        _ozisock.close()
-        logging.debug("Sent Telemetry to OziMux (%d): %s" % (ozi_port, sentence.strip()))
+            logging.warning("Send to broadcast address failed (port %d), sending to localhost instead." % self.port)
+            self.fallback_time = time.time()
+            self.connect(self.LOCALHOST_ADDRESS)
+            self.send_connected(data)
+
+
+# UDP broadcast outputs, keyed by port. These are created on first use.
+udp_broadcasters = {}
+
+def get_udp_broadcaster(port):
+    ''' Get the persistent UDP broadcast output for a port, creating it if necessary. '''
+    if port not in udp_broadcasters:
+        udp_broadcasters[port] = UDPBroadcaster(port)
+
+    return udp_broadcasters[port]
+
+#
+# OziMux UDP Packet Generation Functions
+#
+
+def oziplotter_upload_basic_telemetry(time, latitude, longitude, altitude):
+    """
+    Send a sentence of position data to Oziplotter/OziMux, via UDP.
+    """
+    global ozi_port
+    # Format the sentence directly as bytes, ready to be sent.
+    sentence = b"TELEMETRY,%s,%.5f,%.5f,%d\n" % (time.encode('ascii'), latitude, longitude, altitude)
+
+    try:
+        get_udp_broadcaster(ozi_port).send(sentence)
+        logging.debug("Sent Telemetry to OziMux (%d): %s" % (ozi_port, sentence.strip().decode('ascii')))
         return sentence
     except Exception as e:
         logging.error("Failed to send OziMux packet: %s" % str(e))
@@ -390,13 +635,13 @@ def ozimux_upload(sentence):
         _sentence = sentence.strip()
 
         # First, try and find the start of the sentence, which always starts with '$$''
-        _sentence = _sentence.split('$$')[-1]
-        # Hack to handle odd numbers of $$'s at the start of a sentence
-        if _sentence[0] == '$':
-            _sentence = _sentence[1:]
+        # rpartition alone handles odd numbers of $'s, as the last '$$' always ends the run of $'s.
+        _sentence = _sentence.rpartition('$$')[2]
         # Now try and split out the telemetry from the CRC16.
-        _telem = _sentence.split('*')[0]
-        _crc = _sentence.split('*')[1]
+        (_telem, _sep, _crc) = _sentence.partition('*')
+        if _sep == '':
+            raise ValueError("No CRC16 found.")
+        _crc = _crc.partition('*')[0]
 
         # Now check if the CRC matches.
         _calc_crc = crc16_ccitt(_telem.encode('ascii'))
@@ -406,7 +651,8 @@ def ozimux_upload(sentence):
             return None
 
         # We now have a valid sentence! Extract fields..
-        _fields = _telem.split(',')
+        # Only the first six fields are needed, so don't split up the rest.
+        _fields = _telem.split(',', 6)
 
         _callsign = _fields[0]
         _time = _fields[2]
@@ -417,10 +663,10 @@ def ozimux_upload(sentence):
 
         # Perform some sanity checks on the data.
 
-        # Attempt to parse the time string. This will throw an error if any values are invalid.
-        try:
-            _time_dt = datetime.datetime.strptime(_time, "%H:%M:%S")
-        except:
+        # Check the time string is a valid HH:MM:SS time.
+        if not (len(_time) == 8 and _time[2] == ':' and _time[5] == ':'
+                and _time[0:2].isdigit() and _time[3:5].isdigit() and _time[6:8].isdigit()
+                and int(_time[0:2]) < 24 and int(_time[3:5]) < 60 and int(_time[6:8]) < 60):
             logging.error("Could not parse ASCII Sentence - Invalid Time.")
             return None
 
@@ -493,27 +739,8 @@ def send_payload_summary(telemetry, comment="Horus Binary"):
             'batt_voltage': telemetry['batt_voltage']
         }
 
-        # Set up our UDP socket
-        _s = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
-        _s.settimeout(1)
-        # Set up socket for broadcast, and allow re-use of the address
-        _s.setsockopt(socket.SOL_SOCKET,socket.SO_BROADCAST,1)
-        _s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        # Under OSX we also need to set SO_REUSEPORT to 1
-        try:
-            _s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-        except:
-            pass
-
-        try:
-            _s.sendto(json.dumps(packet).encode('ascii'), ('<broadcast>',summary_port))
-        # Catch any socket errors, that may occur when attempting to send to a broadcast address
-        # when there is no network connected. In this case, re-try and send to localhost instead.
-        except socket.error as e:
-            logging.debug("Horus UDP - Send to broadcast address failed, sending to localhost instead.")
-            _s.sendto(json.dumps(packet).encode('ascii'), ('127.0.0.1', summary_port))
-
-        _s.close()
+        # Encode the packet without any optional whitespace.
+        get_udp_broadcaster(summary_port).send(json.dumps(packet, separators=(',', ':')).encode('ascii'))
 
     except Exception as e:
         logging.error("Horus UDP - Error sending Payload Summary: %s" % str(e))
@@ -541,40 +768,40 @@ def send_payload_summary(telemetry, comment="Horus Binary"):
 # uint8_t   BattVoltage; // 0 = 0v, 255 = 5.0V, linear steps in-between.
 # uint16_t Checksum; // CRC16-CCITT Checksum.
 # };
+_horus_struct = struct.Struct("<BHBBBffHBBbBH")
+
 def decode_horus_binary(data, payload_list = {}):
     ''' Decode a string containing a horus binary packet, and produce a UKHAS ASCII string '''
 
-    horus_format_struct = "<BHBBBffHBBbBH"
-    horus_format_len = 22
-
-    if len(data) != horus_format_len:
+    if len(data) != _horus_struct.size:
         logging.debug("Input sentence not of correct length.")
         return (None, None)
 
     # Attempt to unpack the input data into a struct.
     try:
-        unpacked = struct.unpack(horus_format_struct, data)
+        (_payload_id, _counter, _hours, _minutes, _seconds, _latitude, _longitude,
+            _altitude, _speed, _sats, _temp, _batt_voltage_raw, _checksum) = _horus_struct.unpack_from(data, 0)
     except Exception as e:
         logging.error("Error parsing binary telemetry - %s" % str(e))
         return (None, None)
 
 
-    telemetry = {}
-    telemetry['payload_id'] = unpacked[0]
-    telemetry['counter'] = unpacked[1]
-    telemetry['time'] = "%02d:%02d:%02d" % (unpacked[2],unpacked[3],unpacked[4])
-    telemetry['latitude'] = unpacked[5]
-    telemetry['longitude'] = unpacked[6]
-    telemetry['altitude'] = unpacked[7]
-    telemetry['speed'] = unpacked[8]
-    telemetry['sats'] = unpacked[9]
-    telemetry['temp'] = unpacked[10]
-    telemetry['batt_voltage_raw'] = unpacked[11]
-    telemetry['checksum'] = unpacked[12]
+    telemetry = {
+        'payload_id': _payload_id,
+        'counter': _counter,
+        'time': "%02d:%02d:%02d" % (_hours, _minutes, _seconds),
+        'latitude': _latitude,
+        'longitude': _longitude,
+        'altitude': _altitude,
+        'speed': _speed,
+        'sats': _sats,
+        'temp': _temp,
+        'batt_voltage_raw': _batt_voltage_raw,
+        'checksum': _checksum
+    }
 
-    # Validate the checksum.
-    _crc16 = crcmod.predefined.mkCrcFun('crc-ccitt-false')
-    _calculated_crc = _crc16(data[:-2])
+    # Validate the checksum. The memoryview lets us checksum all but the last two bytes without copying them.
+    _calculated_crc = _crc16_raw(memoryview(data)[:-2])
 
     if _calculated_crc != telemetry['checksum']:
         logging.error("Checksum Mismatch - RX: %s, Calculated: %s" % (hex(telemetry['checksum']), hex(_calculated_crc)))
@@ -592,21 +819,20 @@ def decode_horus_binary(data, payload_list = {}):
     # Convert some of the fields into more useful units.
     telemetry['batt_voltage'] = 5.0*telemetry['batt_voltage_raw']/255.0
 
-    # Generate the UKHAS ASCII sentence 
-    _sentence = "$$%s,%d,%s,%.5f,%.5f,%d,%d,%d,%d,%.2f" % (
+    # Generate the UKHAS ASCII sentence (without the leading $$'s, which are not covered by the checksum)
+    _sentence = "%s,%d,%s,%.5f,%.5f,%d,%d,%d,%d,%.2f" % (
         payload_call,
-        telemetry['counter'],
+        _counter,
         telemetry['time'],
-        telemetry['latitude'],
-        telemetry['longitude'],
-        telemetry['altitude'],
-        telemetry['speed'],
-        telemetry['sats'],
-        telemetry['temp'],
+        _latitude,
+        _longitude,
+        _altitude,
+        _speed,
+        _sats,
+        _temp,
         telemetry['batt_voltage'])
-    # Append checksum
-    _checksum = crc16_ccitt(_sentence[2:].encode('ascii'))
-    _output = _sentence + "*" + _checksum + "\n"
+    # Add the $$'s and checksum
+    _output = "$$%s*%s\n" % (_sentence, crc16_ccitt(_sentence.encode('ascii')))
 
     logging.info("Decoded Binary Telemetry as: %s" % _output.strip())
 
@@ -642,8 +868,8 @@ def handle_binary(data, payload_list = {}):
 
     # Attempt to parse the line of data as hexadecimal.
     try:
-        _binary_string = codecs.decode(data, 'hex')
-    except TypeError as e:
+        _binary_string = binascii.unhexlify(data)
+    except (TypeError, ValueError, binascii.Error) as e:
         logging.error("Error parsing line as hexadecimal (%s): %s" % (str(e), data))
         return
 
@@ -712,23 +938,20 @@ def read_payload_list(filename="payload_id_list.txt"):
 
     try:
         with open(filename,'r') as file:
-            for line in file:
-                # Skip comment lines.
-                if line[0] == '#':
+            for _params in csv.reader(file):
+                # Skip blank and comment lines.
+                if len(_params) == 0 or _params[0].startswith('#'):
                     continue
-                else:
-                    # Attempt to split the line with a comma.
-                    _params = line.split(',')
-                    if len(_params) != 2:
-                        # Invalid line.
-                        logging.error("Could not parse line: %s" % line)
-                    else:
-                        try:
-                            _id = int(_params[0])
-                            _callsign = _params[1].strip()
-                            payload_list[_id] = _callsign
-                        except:
-                            logging.error("Error parsing line: %s" % line)
+
+                if len(_params) != 2:
+                    # Invalid line.
+                    logging.error("Could not parse line: %s" % ','.join(_params))
+                    continue
+
+                try:
+                    payload_list[int(_params[0])] = _params[1].strip()
+                except ValueError:
+                    logging.error("Error parsing line: %s" % ','.join(_params))
     except Exception as e:
         logging.error("Error reading Payload ID list, does it exist? - %s" % str(e))
 
@@ -747,7 +970,7 @@ def grab_latest_payload_id_list(url, local_file="payload_id_list.txt"):
     # Download the list.
     try:
         logging.info("Attempting to download latest payload ID list from GitHub...")
-        _r = requests.get(url, timeout=10)
+        _r = http_session.get(url, timeout=10)
     except Exception as e:
         logging.error("Unable to get latest payload ID list: %s" % str(e))
         return False
@@ -852,7 +1075,8 @@ def main():
     if args.stdin == False:
         # Start up a UDP listener.
         s = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
-        s.settimeout(1)
+        # Block until a packet arrives, rather than waking up every second. (CTRL-C still interrupts the receive.)
+        s.settimeout(None)
         # Set up the socket for address re-use.
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         # On BSD systems we have to do a bit extra.
@@ -862,9 +1086,18 @@ def main():
             pass
         s.bind(('127.0.0.1',user_config['freedv_udp_port']))
         logging.info("Opened UDP socket on port %d." % user_config['freedv_udp_port'])
+        # Received packets are read into this buffer, and decoded to a string straight from it (via a memoryview),
+        # rather than through a new bytes object each time.
+        udp_buffer = bytearray(1500)
+        udp_view = memoryview(udp_buffer)
 
     else:
         logging.info("Waiting for data on stdin.")
+        # stdin is read in large chunks, which are split up into lines here.
+        stdin_fd = sys.stdin.fileno()
+        stdin_partial = b''
+        stdin_lines = deque()
+        stdin_eof = False
 
 
     logging.info("Started Horus Binary Uploader. Hit CTRL-C to exit.")
@@ -874,9 +1107,8 @@ def main():
             # Read lines in from stdin, and strip off any trailing newlines
             if args.stdin == False:
                 try:
-                    data = s.recvfrom(1024)
-                except socket.timeout:
-                    data = None
+                    (data_len, _addr) = s.recvfrom_into(udp_buffer)
+                    data = udp_view[:data_len]
                 except KeyboardInterrupt:
                     break
                 except:
@@ -884,19 +1116,32 @@ def main():
                     data = None
 
                 if data != None:
-                    # s.recvfrom gives us bytes, convert to a string.
-                    data = data[0].decode('ascii')
+                    # The received packet is bytes, convert to a string.
+                    data = ascii_from_buffer(data)
                 else:
                     continue
 
             else:
-                # This will give us a string in both Python 2 and 3.
-                data = sys.stdin.readline()
+                if len(stdin_lines) == 0:
+                    if stdin_eof:
+                        logging.info("Caught EOF, exiting.")
+                        break
+
+                    # Read whatever is available (blocking until something is), and split it into lines.
+                    _chunk = os.read(stdin_fd, 65536)
+                    if _chunk == b'':
+                        # An empty read means stdin has been closed. Handle any unterminated last line first.
+                        stdin_eof = True
+                        _chunk = b'\n'
+
+                    _lines = (stdin_partial + _chunk).split(b'\n')
+                    # The last element is an incomplete line (or empty), keep it for the next read.
+                    stdin_partial = _lines.pop()
+                    stdin_lines.extend(_lines)
+                    continue
 
-            if (args.stdin == False) and (data == ''):
-                # Empty line means stdin has been closed.
-                logging.info("Caught EOF, exiting.")
-                break
+                # Convert the line of bytes to a string.
+                data = stdin_lines.popleft().decode('ascii', 'replace')
 
             # Otherwise, strip any newlines, and continue.
             data = data.rstrip()
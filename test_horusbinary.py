@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+#   Project Horus Binary - CRC16 / Decoder / Uploader Tests
+#
+#   Checks that the binascii.crc_hqx based CRC16 matches CRC16-CCITT-FALSE
+#   (as previously calculated with crcmod), on known-good sentences and packets,
+#   and that the Habitat uploader skips duplicate sentences.
+#
+#   Run with: python -m unittest test_horusbinary
+#
+import binascii
+import threading
+import time
+import unittest
+
+import horusbinary
+
+
+# A Horus Binary packet (as received from horus_demod), and the UKHAS sentence it decodes to.
+HORUS_BINARY_PACKET = "01050001020300000ac200800a43e8030a08fbc85683"
+HORUS_BINARY_SENTENCE = "$$HORUSBINARY,5,01:02:03,-34.50000,138.50000,1000,10,8,-5,3.92*12AF\n"
+
+
+class CRC16Test(unittest.TestCase):
+
+    def test_check_value(self):
+        # Standard CRC16-CCITT-FALSE check value.
+        self.assertEqual(horusbinary.crc16_ccitt(b"123456789"), "29B1")
+
+    def test_ukhas_sentences(self):
+        self.assertEqual(horusbinary.crc16_ccitt(b"FOO,1,2,3"), "6B62")
+        self.assertEqual(horusbinary.crc16_ccitt(b"HORUSBINARY,5,01:02:03,-34.50000,138.50000,1000,10,8,-5,3.92"), "12AF")
+
+    def test_raw_crc(self):
+        self.assertEqual(horusbinary._crc16_raw(b"FOO,1,2,3"), 0x6B62)
+
+
+class DecodeHorusBinaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.payload_list = {0: '4FSKTEST', 1: 'HORUSBINARY'}
+
+    def test_decode(self):
+        (_sentence, _telemetry) = horusbinary.decode_horus_binary(binascii.unhexlify(HORUS_BINARY_PACKET), self.payload_list)
+
+        self.assertEqual(_sentence, HORUS_BINARY_SENTENCE)
+        self.assertEqual(_telemetry['checksum'], 0x8356)
+        self.assertEqual(_telemetry['callsign'], 'HORUSBINARY')
+
+    def test_bad_checksum(self):
+        _packet = bytearray(binascii.unhexlify(HORUS_BINARY_PACKET))
+        _packet[-1] ^= 0xFF
+
+        self.assertEqual(horusbinary.decode_horus_binary(bytes(_packet), self.payload_list), (None, None))
+
+
+class FakeResponse(object):
+    status_code = 201
+
+
+class FakeSession(object):
+    ''' Stands in for a requests Session, counting PUTs which each take upload_time seconds. '''
+
+    def __init__(self, upload_time):
+        self.headers = {}
+        self.upload_time = upload_time
+        self.puts = []
+        self.lock = threading.Lock()
+
+    def put(self, url, data=None, timeout=None):
+        with self.lock:
+            self.puts.append(url)
+        time.sleep(self.upload_time)
+        return FakeResponse()
+
+
+class HabitatUploaderDuplicateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = FakeSession(upload_time=0.2)
+        self._create_http_session = horusbinary.create_http_session
+        horusbinary.create_http_session = lambda: self.session
+
+        self.uploader = horusbinary.HabitatUploader(user_callsign='TEST', upload_retry_interval=0.0)
+
+    def tearDown(self):
+        self.uploader.close()
+        for _thread in self.uploader.uploadthreads:
+            _thread.join()
+
+        horusbinary.create_http_session = self._create_http_session
+
+    def test_duplicate_while_uploading(self):
+        self.uploader.add("$$FOO,1,2*ABCD")
+        time.sleep(0.05)
+        # The first copy is now being uploaded.
+        self.uploader.add("$$FOO,1,2*ABCD")
+        time.sleep(0.5)
+
+        self.assertEqual(len(self.session.puts), 1)
+
+    def test_duplicate_after_upload(self):
+        self.uploader.add("$$FOO,1,2*ABCD")
+        time.sleep(0.5)
+        self.uploader.add("$FOO,1,2*ABCD\n")
+        time.sleep(0.5)
+
+        self.assertEqual(len(self.session.puts), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,8 +26,8 @@ import glob
 import sys
 import os
 import argparse
+import binascii
 import Queue
-import crcmod
 import ConfigParser
 from datetime import datetime
 import traceback
@@ -53,10 +53,11 @@ class FldigiListener(object):
     This is hacked together from FldigiBridge out of the horus_utils repo.
     """
 
-    # Receive thread variables and buffers.
-    rx_thread_running = True
+    __slots__ = ('fldigi_host', 'callback', 'valid_packet_callback', 'log_file',
+        'rx_thread_running', 'input_buffer', 't')
+
+    # Maximum length of a received line.
     MAX_BUFFER_LEN = 256
-    input_buffer = ""
 
 
     def __init__(self,
@@ -76,6 +77,9 @@ class FldigiListener(object):
         else:
             self.log_file = None
 
+        # Receive thread variables and buffers.
+        self.input_buffer = ""
+
         # Start receive thread.
         self.rx_thread_running = True
         self.t = Thread(target=self.rx_thread)
@@ -107,7 +111,7 @@ class FldigiListener(object):
 
             while self.rx_thread_running:
                 try:
-                    _char = _s.recv(1)
+                    _data = _s.recv(4096)
                 except socket.timeout:
                     # No data received? Keep trying...
                     continue
@@ -120,19 +124,24 @@ class FldigiListener(object):
                         pass
                     break
 
+                if _data == '':
+                    # fldigi has closed the connection. Reconnect.
+                    print("ERROR: Connection closed by fldigi.")
+                    _s.close()
+                    break
+
                 # Append to input buffer.
-                self.input_buffer += _char
+                self.input_buffer += _data
+
+                # Process each complete line (including its newline) we have received.
+                while '\n' in self.input_buffer:
+                    (_line, _sep, self.input_buffer) = self.input_buffer.partition('\n')
+                    # Only the last MAX_BUFFER_LEN characters of a line are kept.
+                    self.process_data((_line + _sep)[-self.MAX_BUFFER_LEN:])
+
                 # Roll buffer if we've exceeded the max length.
                 if len(self.input_buffer) > self.MAX_BUFFER_LEN:
-                    self.input_buffer = self.input_buffer[1:]
-
-                # If we have received a newline, attempt to process the current buffer of data.
-                if _char == '\n':
-                    self.process_data(self.input_buffer)
-                    # Clear the buffer and continue.
-                    self.input_buffer = ""
-                else:
-                    continue
+                    self.input_buffer = self.input_buffer[-self.MAX_BUFFER_LEN:]
 
         _s.close()
 
@@ -142,9 +151,9 @@ class FldigiListener(object):
         Calculate the CRC16 CCITT checksum of *data*.
         
         (CRC16 CCITT: start 0xFFFF, poly 0x1021)
+        binascii.crc_hqx implements this CRC (with a 0xFFFF start value) in C.
         """
-        crc16 = crcmod.predefined.mkCrcFun('crc-ccitt-false')
-        return hex(crc16(data))[2:].upper().zfill(4)
+        return "%04X" % binascii.crc_hqx(data, 0xFFFF)
 
 
     def send_to_callback(self, data):
@@ -173,13 +182,13 @@ class FldigiListener(object):
             data = data.strip()
 
             # First, try and find the start of the sentence, which always starts with '$$''
-            _sentence = data.split('$$')[-1]
-            # Hack to handle odd numbers of $$'s at the start of a sentence
-            if _sentence[0] == '$':
-                _sentence = _sentence[1:]
+            # rpartition alone handles odd numbers of $'s, as the last '$$' always ends the run of $'s.
+            _sentence = data.rpartition('$$')[2]
             # Now try and split out the telemetry from the CRC16.
-            _telem = _sentence.split('*')[0]
-            _crc = _sentence.split('*')[1]
+            (_telem, _sep, _crc) = _sentence.partition('*')
+            if _sep == '':
+                return
+            _crc = _crc.partition('*')[0]
 
             # Now check if the CRC matches.
             _calc_crc = self.crc16_ccitt(_telem)